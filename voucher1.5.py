@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
 import asyncio
 
+import csv
+import hashlib
 import logging
 import signal
 import json
 import os
 import discord
+import orjson
 import pyotp
+import sqlite3
 import sys
+import time
 import aiosqlite
-from io import BytesIO
-from datetime import datetime, timedelta, timezone
+from aiosqlitepool import SQLiteConnectionPool
+from io import BytesIO, TextIOWrapper
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from dotenv import load_dotenv
 
@@ -32,17 +41,26 @@ if not TOKEN:
 
 if not TOTP_SECRET:
     print("WARNING: TOTP_SECRET is not set. /shutdown will not work until you set it.")
-    
+
+# The secret never changes at runtime, so build the verifier once.
+_TOTP = pyotp.TOTP(TOTP_SECRET) if TOTP_SECRET else None
+
+
 # ---------- INTENTS ----------
 intents = discord.Intents.default()
 intents.members = True  # needed for joined_at + role actions reliability
 bot = commands.Bot(command_prefix="!", intents=intents)
 
+# Route discord.py's payload (de)serialization through orjson's C encoder.
+discord.utils._from_json = orjson.loads
+discord.utils._to_json = lambda obj: orjson.dumps(obj).decode("utf-8")
+
 # ---------- CONFIG ----------
 OWNER_ID = 906781117632368730
 STATUS_CHANNEL_ID = 1461148246863773698
 
 DB_FILE = "vouches.db"
+COMMAND_HASH_FILE = ".command_hash"
 
 # ---------- LOGGING ----------
 logging.basicConfig(
@@ -52,28 +70,89 @@ logging.basicConfig(
 log = logging.getLogger("voucher")
 
 # ---------- SQLITE HARDENING (NO LOGIC CHANGES) ----------
-_db_lock = asyncio.Lock()
-
 async def db_connect(path: str):
     """
     Returns an aiosqlite connection with production-safe pragmas.
     Keeps same schema/queries/behavior—just makes SQLite more reliable under load.
     """
-    db = await aiosqlite.connect(path)
+    db = await aiosqlite.connect(path, cached_statements=256)
     # WAL helps concurrency; busy_timeout reduces "database is locked"
     await db.execute("PRAGMA journal_mode=WAL;")
     await db.execute("PRAGMA synchronous=NORMAL;")
     await db.execute("PRAGMA busy_timeout=5000;")
     await db.execute("PRAGMA foreign_keys=ON;")
+    # 20 MB page cache + in-memory temp store: pooled connections live long
+    # enough now for a warm cache to pay off.
+    await db.execute("PRAGMA cache_size=-20000;")
+    await db.execute("PRAGMA temp_store=MEMORY;")
+    # Memory-map the database file (256 MB) so reads skip the read() syscall
+    # and share pages across the pooled connections.
+    await db.execute("PRAGMA mmap_size=268435456;")
+    # sqlite3.Row is a C struct with O(1) name lookup and still unpacks like a
+    # tuple, so readers can use column names without extra per-row cost.
+    db.row_factory = aiosqlite.Row
     return db
 
+# Pooled connections: keeps SQLite's page cache hot across queries instead of
+# paying connect + PRAGMA setup + teardown on every helper call.
+POOL = SQLiteConnectionPool(connection_factory=lambda: db_connect(DB_FILE), pool_size=8)
+
+# WAL allows N readers but only one writer: readers borrow straight from the
+# pool, writers also serialize on this userspace lock so concurrent writes
+# queue here instead of colliding on SQLITE_BUSY.
+_write_lock = asyncio.Lock()
+
 @asynccontextmanager
-async def db_open(path: str):
-    db = await db_connect(path)
+async def db_write():
+    async with _write_lock:
+        async with POOL.connection() as db:
+            yield db
+
+# Dedicated vouch writer: a plain sqlite3 connection on a single-thread
+# executor runs the whole BEGIN IMMEDIATE / INSERT / COMMIT sequence as one
+# blocking call, so the event loop pays one thread hop instead of three, and
+# the single thread serializes vouch writes by construction.
+_writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vouch-writer")
+_writer_conn: sqlite3.Connection | None = None
+
+def _get_writer_conn() -> sqlite3.Connection:
+    global _writer_conn
+    if _writer_conn is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        _writer_conn = conn
+    return _writer_conn
+
+def _write_vouch_sync(params: tuple):
+    conn = _get_writer_conn()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(_SQL_INSERT_VOUCH, params)
+        conn.commit()
+    except Exception:
+        # Roll back so a single failed write doesn't leave the long-lived
+        # connection stuck inside an open transaction.
+        conn.rollback()
+        raise
+
+async def write_vouch(params: tuple):
+    # Same userspace serialization as db_write(): vouch inserts and config
+    # writes queue on _write_lock instead of contending on busy_timeout.
+    async with _write_lock:
+        await asyncio.get_running_loop().run_in_executor(_writer_pool, _write_vouch_sync, params)
+
+def close_writer():
+    global _writer_conn
     try:
-        yield db
-    finally:
-        await db.close()
+        _writer_pool.shutdown(wait=True)
+        if _writer_conn is not None:
+            _writer_conn.close()
+            _writer_conn = None
+    except Exception:
+        pass
 
 
 PAGE_SIZE = 5  # vouches per page
@@ -82,6 +161,11 @@ PAGE_SIZE = 5  # vouches per page
 MIN_ACCOUNT_AGE_DAYS = 7
 MIN_SERVER_JOIN_HOURS = 6
 
+# Same thresholds in seconds, so the submit path compares plain floats
+# instead of allocating timedelta objects.
+_MIN_ACCT_SECS = MIN_ACCOUNT_AGE_DAYS * 86400
+_MIN_JOIN_SECS = MIN_SERVER_JOIN_HOURS * 3600
+
 # Protected roles (staff immunity). Put role IDs here.
 PROTECTED_ROLE_IDS = [
     1460784670487871589, 1460060689325490216, 1460056861750595654, 1460054414294253730
@@ -329,6 +413,8 @@ class SetupWizardView(discord.ui.View):
         await cfg_set(gid, "RESTRICTED_MIN_VOUCHES", int(self.state.restricted_min_vouches or 0))
         await cfg_set(gid, "RESTRICTED_MAX_AVG", float(self.state.restricted_max_avg or 0.0))
 
+        invalidate_gate_cache(gid)
+
         for child in self.children:
             if hasattr(child, "disabled"):
                 child.disabled = True
@@ -390,7 +476,7 @@ DEFAULT_CONFIG = {
 }
 
 async def init_config_table():
-    async with _db_lock, db_open(DB_FILE) as db:
+    async with POOL.connection() as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS guild_config (
                 guild_id INTEGER NOT NULL,
@@ -403,7 +489,7 @@ async def init_config_table():
 
 async def cfg_get(guild_id: int, key: str):
     """Get config value for guild, falling back to DEFAULT_CONFIG."""
-    async with _db_lock, db_open(DB_FILE) as db:
+    async with POOL.connection() as db:
         cur = await db.execute(
             "SELECT value FROM guild_config WHERE guild_id=? AND key=?",
             (guild_id, key),
@@ -422,7 +508,7 @@ async def cfg_get(guild_id: int, key: str):
 async def cfg_set(guild_id: int, key: str, value):
     """Set config value for guild (stored as JSON)."""
     raw = json.dumps(value)
-    async with _db_lock, db_open(DB_FILE) as db:
+    async with db_write() as db:
         await db.execute(
             "INSERT INTO guild_config (guild_id, key, value) VALUES (?, ?, ?) "
             "ON CONFLICT(guild_id, key) DO UPDATE SET value=excluded.value",
@@ -448,13 +534,73 @@ LOCK = "\U0001F510"      # 🔐
 WARN = "\u26A0"          # ⚠️
 TROPHY = "\U0001F3C6"    # 🏆
 
+# Ratings are 1-5, so precompute the star strings once instead of repeating
+# STAR * rating per row.
+_STAR_TABLE = tuple(STAR * i for i in range(6))
+
+# Valid rating inputs mapped to their integer value; a dict lookup avoids
+# raising/catching ValueError on every bad submission.
+_RATING_MAP = {"1": 1, "2": 2, "3": 3, "4": 4, "5": 5}
+
+# Shared AllowedMentions instance: the same immutable settings were being
+# re-allocated at every send/edit call site.
+_AM_USERS = discord.AllowedMentions(users=True)
+
 # ---------- SOFTLOCK STATE ----------
-_softlock_previous = {}  # channel_id -> previous overwrite for @everyone
+@dataclass(slots=True)
+class SavedOverwrite:
+    """Snapshot of the @everyone overwrite fields softlock touches.
+
+    A compact slots instance instead of holding whole PermissionOverwrite
+    objects; also means later mutation of the live overwrite can't corrupt
+    the saved state.
+    """
+    send_messages: bool | None
+    add_reactions: bool | None
+    create_public_threads: bool | None
+    create_private_threads: bool | None
+
+# channel_id -> saved @everyone fields; capped so channels that are locked
+# and never unlocked can't grow this without bound.
+_SOFTLOCK_PREVIOUS_MAX = 1024
+_softlock_previous: OrderedDict[int, SavedOverwrite] = OrderedDict()
+
+# Write-behind queue: toggles update in-memory state and mark the channel
+# dirty; the 1s flusher coalesces bursts into one set_permissions per channel.
+# on_success runs only after the Discord call lands, for state that must not
+# be dropped until the overwrite actually changed.
+_softlock_pending: dict[int, tuple[discord.TextChannel, discord.PermissionOverwrite, str, object]] = {}
+_softlock_dirty: set[int] = set()
+_softlock_flush_sem = asyncio.Semaphore(8)  # bounded concurrency for rate limits
+
+def queue_overwrite_flush(channel: discord.TextChannel, overwrite: discord.PermissionOverwrite, reason: str, on_success=None):
+    _softlock_pending[channel.id] = (channel, overwrite, reason, on_success)
+    _softlock_dirty.add(channel.id)
+
+async def _flush_overwrite(channel: discord.TextChannel, overwrite: discord.PermissionOverwrite, reason: str, on_success=None):
+    async with _softlock_flush_sem:
+        try:
+            await channel.set_permissions(channel.guild.default_role, overwrite=overwrite, reason=reason)
+        except Exception as e:
+            log.warning("%s flush failed for channel %s: %r", reason, channel.id, e)
+        else:
+            if on_success is not None:
+                on_success()
+
+@tasks.loop(seconds=1.0)
+async def flush_softlock_changes():
+    if not _softlock_dirty:
+        return
+    keys = list(_softlock_dirty)
+    _softlock_dirty.clear()
+    pending = [_softlock_pending.pop(cid) for cid in keys if cid in _softlock_pending]
+    if pending:
+        await asyncio.gather(*(_flush_overwrite(ch, ow, reason, cb) for ch, ow, reason, cb in pending))
 
 
 # ---------- DB ----------
 async def init_db():
-    async with _db_lock, db_open(DB_FILE) as db:
+    async with POOL.connection() as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS vouches (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -466,63 +612,356 @@ async def init_db():
                 rating INTEGER NOT NULL,
                 traded_item TEXT NOT NULL,
                 created_at TEXT NOT NULL,
+                created_at_ts INTEGER,
                 suspicious INTEGER NOT NULL DEFAULT 0
             )
         """)
+        # Migration for databases created before created_at_ts existed.
+        try:
+            await db.execute("ALTER TABLE vouches ADD COLUMN created_at_ts INTEGER")
+        except Exception:
+            pass
+        await db.execute("""
+            UPDATE vouches
+            SET created_at_ts = strftime('%s', replace(created_at, ' UTC', ''))
+            WHERE created_at_ts IS NULL
+        """)
+        # Hot predicates: every lookup filters by (guild_id, vouched_user_id)
+        # and pages by id DESC; suspicious detection also keys on the voucher.
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_vouches_guild_user
+            ON vouches(guild_id, vouched_user_id, id DESC)
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_vouches_voucher
+            ON vouches(guild_id, voucher_user_id, vouched_user_id, created_at_ts)
+        """)
+        # Partial index for the /stats top-middlemen GROUP BY: only rows that
+        # actually have a middleman are indexed.
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_vouches_guild_middleman
+            ON vouches(guild_id, middleman_user_id)
+            WHERE middleman_user_id IS NOT NULL
+        """)
+        # Running aggregates: every COUNT/AVG the bot serves is monotonic and
+        # updatable at insert time, so keep per-user and per-middleman sums in
+        # side tables and read them with a primary-key lookup. These supersede
+        # the earlier vouch_counts counter table (count lives here now).
+        await db.execute("DROP TRIGGER IF EXISTS trg_vouch_counts_ins")
+        await db.execute("DROP TRIGGER IF EXISTS trg_vouch_counts_del")
+        await db.execute("DROP TABLE IF EXISTS vouch_counts")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS vouch_stats_user (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                sum_rating INTEGER NOT NULL DEFAULT 0,
+                suspicious_count INTEGER NOT NULL DEFAULT 0,
+                mm_count INTEGER NOT NULL DEFAULT 0,
+                mm_sum_rating INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, user_id)
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS vouch_stats_middleman (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                sum_rating INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (guild_id, user_id)
+            )
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_vouch_stats_ins
+            AFTER INSERT ON vouches
+            BEGIN
+                INSERT INTO vouch_stats_user (
+                    guild_id, user_id, count, sum_rating, suspicious_count, mm_count, mm_sum_rating
+                )
+                VALUES (
+                    NEW.guild_id, NEW.vouched_user_id, 1, NEW.rating, NEW.suspicious,
+                    CASE WHEN NEW.middleman_user_id IS NOT NULL THEN 1 ELSE 0 END,
+                    CASE WHEN NEW.middleman_user_id IS NOT NULL THEN NEW.rating ELSE 0 END
+                )
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                    count = count + 1,
+                    sum_rating = sum_rating + NEW.rating,
+                    suspicious_count = suspicious_count + NEW.suspicious,
+                    mm_count = mm_count + CASE WHEN NEW.middleman_user_id IS NOT NULL THEN 1 ELSE 0 END,
+                    mm_sum_rating = mm_sum_rating + CASE WHEN NEW.middleman_user_id IS NOT NULL THEN NEW.rating ELSE 0 END;
+
+                INSERT INTO vouch_stats_middleman (guild_id, user_id, count, sum_rating)
+                SELECT NEW.guild_id, NEW.middleman_user_id, 1, NEW.rating
+                WHERE NEW.middleman_user_id IS NOT NULL
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                    count = count + 1,
+                    sum_rating = sum_rating + NEW.rating;
+            END
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_vouch_stats_del
+            AFTER DELETE ON vouches
+            BEGIN
+                UPDATE vouch_stats_user SET
+                    count = count - 1,
+                    sum_rating = sum_rating - OLD.rating,
+                    suspicious_count = suspicious_count - OLD.suspicious,
+                    mm_count = mm_count - CASE WHEN OLD.middleman_user_id IS NOT NULL THEN 1 ELSE 0 END,
+                    mm_sum_rating = mm_sum_rating - CASE WHEN OLD.middleman_user_id IS NOT NULL THEN OLD.rating ELSE 0 END
+                WHERE guild_id = OLD.guild_id AND user_id = OLD.vouched_user_id;
+
+                UPDATE vouch_stats_middleman SET
+                    count = count - 1,
+                    sum_rating = sum_rating - OLD.rating
+                WHERE guild_id = OLD.guild_id AND user_id = OLD.middleman_user_id
+                  AND OLD.middleman_user_id IS NOT NULL;
+            END
+        """)
+        # Backfill/repair on startup so the aggregates stay exact for
+        # databases that predate the tables (or were edited outside the bot).
+        await db.execute("""
+            INSERT INTO vouch_stats_user (
+                guild_id, user_id, count, sum_rating, suspicious_count, mm_count, mm_sum_rating
+            )
+            SELECT guild_id, vouched_user_id, COUNT(*), SUM(rating), SUM(suspicious),
+                   SUM(CASE WHEN middleman_user_id IS NOT NULL THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN middleman_user_id IS NOT NULL THEN rating ELSE 0 END)
+            FROM vouches
+            GROUP BY guild_id, vouched_user_id
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                count = excluded.count,
+                sum_rating = excluded.sum_rating,
+                suspicious_count = excluded.suspicious_count,
+                mm_count = excluded.mm_count,
+                mm_sum_rating = excluded.mm_sum_rating
+        """)
+        await db.execute("""
+            INSERT INTO vouch_stats_middleman (guild_id, user_id, count, sum_rating)
+            SELECT guild_id, middleman_user_id, COUNT(*), SUM(rating)
+            FROM vouches
+            WHERE middleman_user_id IS NOT NULL
+            GROUP BY guild_id, middleman_user_id
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                count = excluded.count,
+                sum_rating = excluded.sum_rating
+        """)
         await db.commit()
 
 
 def utc_now_str() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+    # Plain integer formatting: same output as the old strftime call without
+    # its locale-aware format-spec parsing on every vouch insert.
+    n = datetime.now(timezone.utc)
+    return f"{n.year:04d}-{n.month:02d}-{n.day:02d} {n.hour:02d}:{n.minute:02d}:{n.second:02d} UTC"
+
+
+# Hot SQL hoisted to module constants: passing the identical string object on
+# every call keys SQLite's per-connection statement cache, skipping re-prepare.
+_SQL_TOTAL = """
+    SELECT count
+    FROM vouch_stats_user
+    WHERE guild_id = ? AND user_id = ?
+"""
+
+_SQL_FETCH_FIRST = """
+    SELECT id, voucher_user_id, trader_user_id, middleman_user_id, rating, traded_item, created_at, suspicious
+    FROM vouches
+    WHERE guild_id = ? AND vouched_user_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+_SQL_FETCH_AFTER = """
+    SELECT id, voucher_user_id, trader_user_id, middleman_user_id, rating, traded_item, created_at, suspicious
+    FROM vouches
+    WHERE guild_id = ? AND vouched_user_id = ? AND id < ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+
+_SQL_STATS = """
+    SELECT count, sum_rating, suspicious_count, mm_count, mm_sum_rating
+    FROM vouch_stats_user
+    WHERE guild_id = ? AND user_id = ?
+"""
+
+_SQL_SUSP = """
+    SELECT EXISTS(
+        SELECT 1 FROM vouches
+        WHERE guild_id = ? AND vouched_user_id = ? AND voucher_user_id = ?
+          AND created_at_ts >= strftime('%s', 'now', '-7 days')
+    ) OR EXISTS(
+        SELECT 1 FROM vouches
+        WHERE guild_id = ? AND vouched_user_id = ? AND voucher_user_id = ?
+          AND created_at_ts >= strftime('%s', 'now', '-14 days')
+    )
+"""
+
+_SQL_INSERT_VOUCH = """
+    INSERT INTO vouches (
+        guild_id, vouched_user_id, voucher_user_id,
+        trader_user_id, middleman_user_id,
+        rating, traded_item, created_at, created_at_ts, suspicious
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Guild totals and the top-5 middlemen in one statement (tagged by `kind` and
+# split in Python) so /stats costs a single round trip through the executor.
+_SQL_GUILD_OVERVIEW = """
+    SELECT 'agg' AS kind, NULL AS user_id,
+           COALESCE(SUM(count), 0) AS count,
+           SUM(sum_rating) * 1.0 / SUM(count) AS avg_rating,
+           COALESCE(SUM(suspicious_count), 0) AS suspicious
+    FROM vouch_stats_user
+    WHERE guild_id = ?
+    UNION ALL
+    SELECT 'mm', user_id, count, sum_rating * 1.0 / count, NULL
+    FROM (
+        SELECT user_id, count, sum_rating
+        FROM vouch_stats_middleman
+        WHERE guild_id = ? AND count > 0
+        ORDER BY count DESC
+        LIMIT 5
+    )
+"""
+
+_SQL_LEADERBOARD = """
+    SELECT user_id, count, sum_rating * 1.0 / count AS a
+    FROM vouch_stats_user
+    WHERE guild_id = ? AND count > 0
+    ORDER BY count DESC, a DESC
+    LIMIT 10
+"""
+
+_SQL_EXPORT = """
+    SELECT id, voucher_user_id, trader_user_id, middleman_user_id, rating, traded_item, created_at, suspicious
+    FROM vouches
+    WHERE guild_id = ? AND vouched_user_id = ?
+    ORDER BY id DESC
+"""
+
+
+async def fetch_vouch_total(guild_id: int, vouched_user_id: int) -> int:
+    async with POOL.connection() as db:
+        cur = await db.execute(_SQL_TOTAL, (guild_id, vouched_user_id))
+        row = await cur.fetchone()
+    return int(row[0]) if row else 0
 
 
-async def fetch_vouches_page(guild_id: int, vouched_user_id: int, page: int):
-    """Returns (rows, total_count). page is 0-based."""
-    offset = page * PAGE_SIZE
-    async with _db_lock, db_open(DB_FILE) as db:
-        cur_total = await db.execute("""
-            SELECT COUNT(*)
-            FROM vouches
-            WHERE guild_id = ? AND vouched_user_id = ?
-        """, (guild_id, vouched_user_id))
-        total = (await cur_total.fetchone())[0]
+async def fetch_vouches_after(guild_id: int, vouched_user_id: int, before_id: int | None, limit: int):
+    """Keyset page: up to `limit` rows older than `before_id` (newest first).
+
+    Pass before_id=None for the first page. Unlike LIMIT/OFFSET this is a
+    B-tree seek, so deep pages cost the same as the first one.
+    """
+    async with POOL.connection() as db:
+        if before_id is None:
+            cur = await db.execute(_SQL_FETCH_FIRST, (guild_id, vouched_user_id, limit))
+        else:
+            cur = await db.execute(_SQL_FETCH_AFTER, (guild_id, vouched_user_id, before_id, limit))
+        return await cur.fetchall()
+
+
+# Trust stats get re-read in bursts (trust gate after every vouch, repeated
+# /trust calls), so cache per (guild_id, user_id) and invalidate on insert.
+_STATS_TTL = 30.0
+_STATS_CACHE_MAX = 4096
+_stats_cache: dict[tuple[int, int], tuple[float, dict]] = {}
+
+def invalidate_trust_stats(guild_id: int, user_id: int):
+    _stats_cache.pop((guild_id, user_id), None)
+
+def clear_stats_cache():
+    _stats_cache.clear()
 
-        cur = await db.execute("""
-            SELECT id, voucher_user_id, trader_user_id, middleman_user_id, rating, traded_item, created_at, suspicious
-            FROM vouches
-            WHERE guild_id = ? AND vouched_user_id = ?
-            ORDER BY id DESC
-            LIMIT ? OFFSET ?
-        """, (guild_id, vouched_user_id, PAGE_SIZE, offset))
-        rows = await cur.fetchall()
 
-    return rows, total
+# /stats and /leaderboard give every caller the same answer within a short
+# window, so cache the built embed per guild and skip the DB entirely on
+# repeat hits. Invalidated for the guild whenever a vouch lands.
+_AGG_TTL = 10.0
+_agg_cache: dict[tuple[str, int], tuple[float, discord.Embed]] = {}
+
+def agg_cache_get(name: str, guild_id: int) -> discord.Embed | None:
+    entry = _agg_cache.get((name, guild_id))
+    if entry is not None and time.monotonic() - entry[0] < _AGG_TTL:
+        return entry[1]
+    return None
+
+def agg_cache_put(name: str, guild_id: int, embed: discord.Embed):
+    _agg_cache[(name, guild_id)] = (time.monotonic(), embed)
+
+def invalidate_agg_cache(guild_id: int):
+    _agg_cache.pop(("stats", guild_id), None)
+    _agg_cache.pop(("leaderboard", guild_id), None)
 
 
 async def get_user_trust_stats(guild_id: int, user_id: int):
     """Returns dict of trust stats for a vouched user."""
-    async with _db_lock, db_open(DB_FILE) as db:
-        cur = await db.execute("""
-            SELECT COUNT(*), AVG(rating), SUM(suspicious)
-            FROM vouches
-            WHERE guild_id = ? AND vouched_user_id = ?
-        """, (guild_id, user_id))
-        total, avg, suspicious_sum = await cur.fetchone()
+    key = (guild_id, user_id)
+    cached = _stats_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < _STATS_TTL:
+        return cached[1]
+
+    async with POOL.connection() as db:
+        # One primary-key lookup against the running aggregates; averages are
+        # derived from the maintained sums.
+        cur = await db.execute(_SQL_STATS, (guild_id, user_id))
+        row = await cur.fetchone()
 
-        cur2 = await db.execute("""
-            SELECT COUNT(*), AVG(rating)
+    if row is None:
+        stats = {
+            "total": 0,
+            "avg": None,
+            "suspicious": 0,
+            "middleman_count": 0,
+            "middleman_avg": None,
+        }
+    else:
+        total, sum_rating, suspicious_count, mm_count, mm_sum_rating = row
+        stats = {
+            "total": int(total),
+            "avg": (sum_rating / total) if total else None,
+            "suspicious": int(suspicious_count),
+            "middleman_count": int(mm_count),
+            "middleman_avg": (mm_sum_rating / mm_count) if mm_count else None,
+        }
+
+    if len(_stats_cache) >= _STATS_CACHE_MAX:
+        _stats_cache.clear()
+    _stats_cache[key] = (time.monotonic(), stats)
+    return stats
+
+
+# Recency data for suspicious detection is tiny and hot, so keep it in RAM:
+# (guild_id, vouched_user_id, voucher_user_id) -> unix ts of the latest vouch.
+# Warmed from the DB at startup; SQL is only the fallback until that finishes.
+_RECENT_SAME_WINDOW = 7 * 86400
+_RECENT_MUTUAL_WINDOW = 14 * 86400
+_recent_vouches: dict[tuple[int, int, int], int] = {}
+_recent_warm = False
+
+def record_recent_vouch(guild_id: int, vouched_user_id: int, voucher_user_id: int, ts: int):
+    _recent_vouches[(guild_id, vouched_user_id, voucher_user_id)] = ts
+
+async def warm_recent_vouches():
+    global _recent_warm
+    async with POOL.connection() as db:
+        cur = await db.execute("""
+            SELECT guild_id, vouched_user_id, voucher_user_id, MAX(created_at_ts)
             FROM vouches
-            WHERE guild_id = ? AND vouched_user_id = ? AND middleman_user_id IS NOT NULL
-        """, (guild_id, user_id))
-        mm_count, mm_avg = await cur2.fetchone()
+            WHERE created_at_ts >= strftime('%s', 'now', '-14 days')
+            GROUP BY guild_id, vouched_user_id, voucher_user_id
+        """)
+        async for row in cur:
+            _recent_vouches[(row[0], row[1], row[2])] = int(row[3] or 0)
+    _recent_warm = True
 
-    return {
-        "total": int(total or 0),
-        "avg": float(avg) if avg is not None else None,
-        "suspicious": int(suspicious_sum or 0),
-        "middleman_count": int(mm_count or 0),
-        "middleman_avg": float(mm_avg) if mm_avg is not None else None,
-    }
+@tasks.loop(hours=1)
+async def prune_recent_vouches():
+    cutoff = int(time.time()) - _RECENT_MUTUAL_WINDOW
+    stale = [key for key, ts in _recent_vouches.items() if ts < cutoff]
+    for key in stale:
+        _recent_vouches.pop(key, None)
 
 
 async def detect_suspicious_vouch(guild_id: int, vouched_user_id: int, voucher_user_id: int) -> int:
@@ -532,61 +971,81 @@ async def detect_suspicious_vouch(guild_id: int, vouched_user_id: int, voucher_u
     - Mutual vouching loop recently
     Returns 1 if suspicious else 0.
     """
-    async with _db_lock, db_open(DB_FILE) as db:
-        # same voucher -> same target within last 7 days
-        cur = await db.execute("""
-            SELECT COUNT(*)
-            FROM vouches
-            WHERE guild_id = ? AND vouched_user_id = ? AND voucher_user_id = ?
-              AND datetime(replace(created_at,' UTC','')) >= datetime('now','-7 days')
-        """, (guild_id, vouched_user_id, voucher_user_id))
-        recent_same = (await cur.fetchone())[0] or 0
-
-        # mutual loop in last 14 days: A vouched B and B vouched A
-        cur2 = await db.execute("""
-            SELECT COUNT(*)
-            FROM vouches
-            WHERE guild_id = ?
-              AND vouched_user_id = ?
-              AND voucher_user_id = ?
-              AND datetime(replace(created_at,' UTC','')) >= datetime('now','-14 days')
-        """, (guild_id, voucher_user_id, vouched_user_id))
-        mutual = (await cur2.fetchone())[0] or 0
-
-    if recent_same >= 1:
+    now = int(time.time())
+
+    same = _recent_vouches.get((guild_id, vouched_user_id, voucher_user_id))
+    if same is not None and now - same < _RECENT_SAME_WINDOW:
         return 1
-    if mutual >= 1:
+
+    mutual = _recent_vouches.get((guild_id, voucher_user_id, vouched_user_id))
+    if mutual is not None and now - mutual < _RECENT_MUTUAL_WINDOW:
         return 1
-    return 0
 
+    if _recent_warm:
+        return 0
 
+    async with POOL.connection() as db:
+        # One round-trip; EXISTS stops at the first matching row instead of
+        # counting them all. First branch: same voucher -> same target within
+        # 7 days. Second: mutual loop (A vouched B and B vouched A) in 14 days.
+        cur = await db.execute(_SQL_SUSP, (
+            guild_id, vouched_user_id, voucher_user_id,
+            guild_id, voucher_user_id, vouched_user_id,
+        ))
+        flagged = (await cur.fetchone())[0]
 
-async def apply_trust_gate(guild: discord.Guild, member: discord.Member):
-    """Auto-assign Trusted/Restricted roles based on vouch stats. Safe + permission-checked."""
-    if guild is None:
-        return
+    return int(flagged or 0)
 
+
+
+# apply_trust_gate runs after every vouch; resolving the configured roles and
+# hierarchy checks each time walks config + discord.py dicts for a result that
+# only changes when the guild's roles (or config) change. Cache it per guild.
+_gate_cache: dict[int, tuple] = {}
+
+def invalidate_gate_cache(guild_id: int):
+    _gate_cache.pop(guild_id, None)
+
+
+async def _resolve_gate_roles(guild: discord.Guild, me: discord.Member) -> tuple:
+    """Returns (trusted_role, restricted_role, can_manage_trusted, can_manage_restricted)."""
     trusted_role_id = await cfg_get(guild.id, "TRUSTED_ROLE_ID")
     restricted_role_id = await cfg_get(guild.id, "RESTRICTED_ROLE_ID")
 
-    if (not trusted_role_id or int(trusted_role_id) == 0) and (not restricted_role_id or int(restricted_role_id) == 0):
+    trusted_role = guild.get_role(int(trusted_role_id)) if trusted_role_id and int(trusted_role_id) != 0 else None
+    restricted_role = guild.get_role(int(restricted_role_id)) if restricted_role_id and int(restricted_role_id) != 0 else None
+
+    return (
+        trusted_role,
+        restricted_role,
+        trusted_role is not None and me.top_role > trusted_role,
+        restricted_role is not None and me.top_role > restricted_role,
+    )
+
+
+async def apply_trust_gate(guild: discord.Guild, member: discord.Member):
+    """Auto-assign Trusted/Restricted roles based on vouch stats. Safe + permission-checked."""
+    if guild is None:
         return
 
     me = guild.me
     if me is None or not me.guild_permissions.manage_roles:
         return
 
+    cached = _gate_cache.get(guild.id)
+    if cached is None:
+        cached = await _resolve_gate_roles(guild, me)
+        _gate_cache[guild.id] = cached
+    trusted_role, restricted_role, can_manage_trusted, can_manage_restricted = cached
+
+    if trusted_role is None and restricted_role is None:
+        return
+
     trusted_min_vouches = await cfg_get(guild.id, "TRUSTED_MIN_VOUCHES")
     trusted_min_avg = await cfg_get(guild.id, "TRUSTED_MIN_AVG")
     restricted_min_vouches = await cfg_get(guild.id, "RESTRICTED_MIN_VOUCHES")
     restricted_max_avg = await cfg_get(guild.id, "RESTRICTED_MAX_AVG")
 
-    trusted_role = guild.get_role(int(trusted_role_id)) if trusted_role_id and int(trusted_role_id) != 0 else None
-    restricted_role = guild.get_role(int(restricted_role_id)) if restricted_role_id and int(restricted_role_id) != 0 else None
-
-    def can_manage(role: discord.Role | None) -> bool:
-        return role is not None and me.top_role > role
-
     stats = await get_user_trust_stats(guild.id, member.id)
     total = stats["total"]
     avg = stats["avg"]
@@ -596,57 +1055,96 @@ async def apply_trust_gate(guild: discord.Guild, member: discord.Member):
     should_trust = (total >= int(trusted_min_vouches or 0) and avg >= float(trusted_min_avg or 0))
     should_restrict = (total >= int(restricted_min_vouches or 0) and avg <= float(restricted_max_avg or 0))
 
+    # Diff the desired role set in-memory and apply it with at most one
+    # member.edit call instead of up to four add/remove round-trips.
+    current = set(member.roles)
+    target = set(current)
+
+    if restricted_role and can_manage_restricted:
+        if should_restrict:
+            target.add(restricted_role)
+        else:
+            target.discard(restricted_role)
+
+    if trusted_role and can_manage_trusted:
+        if should_trust:
+            target.add(trusted_role)
+        else:
+            target.discard(trusted_role)
+
+    if target == current:
+        return
+
     try:
-        if restricted_role and can_manage(restricted_role):
-            if should_restrict and restricted_role not in member.roles:
-                await member.add_roles(restricted_role, reason="Trust gate: restricted (low avg rating)")
-            if (not should_restrict) and restricted_role in member.roles:
-                await member.remove_roles(restricted_role, reason="Trust gate: remove restricted (no longer meets criteria)")
-
-        if trusted_role and can_manage(trusted_role):
-            if should_trust and trusted_role not in member.roles:
-                await member.add_roles(trusted_role, reason="Trust gate: trusted (high avg rating)")
-            if (not should_trust) and trusted_role in member.roles:
-                await member.remove_roles(trusted_role, reason="Trust gate: remove trusted (no longer meets criteria)")
+        await member.edit(roles=list(target), reason="Trust gate: sync trusted/restricted roles")
     except discord.Forbidden:
         pass
     except Exception:
         pass
 
 
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    invalidate_gate_cache(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    invalidate_gate_cache(role.guild.id)
+
+
+# Coalesce gate work: a burst of vouches for the same member schedules one
+# apply_trust_gate pass after a short window instead of one per vouch.
+_GATE_DEBOUNCE_SECONDS = 2.0
+_pending_gate: dict[tuple[int, int], asyncio.Task] = {}
+
+def schedule_trust_gate(guild: discord.Guild, member: discord.Member):
+    if guild is None:
+        return
+    key = (guild.id, member.id)
+    if key in _pending_gate:
+        return
+
+    async def _debounced():
+        try:
+            await asyncio.sleep(_GATE_DEBOUNCE_SECONDS)
+            await apply_trust_gate(guild, member)
+        finally:
+            _pending_gate.pop(key, None)
+
+    _pending_gate[key] = asyncio.create_task(_debounced())
+
+
 def build_vouches_embed(user: discord.Member, rows, total: int, page: int) -> discord.Embed:
     total_pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
-    embed = discord.Embed(
-        title=f"Vouches for {user}",
-        description=f"Total vouches: **{total}**",
-        color=discord.Color.blurple()
-    )
-    embed.set_footer(text=f"Page {page + 1}/{total_pages} • Showing {PAGE_SIZE} per page")
-
-    if not rows:
-        embed.add_field(name="No vouches", value="No results on this page.", inline=False)
-        return embed
 
+    # Assemble the raw payload and hand it to Embed.from_dict in one go,
+    # skipping the per-field bookkeeping add_field does.
     start_index = page * PAGE_SIZE
-    for i, (vid, voucher_id, trader_id, middleman_id, rating, traded_item, created_at, suspicious) in enumerate(rows, start=1):
-        voucher_mention = f"<@{voucher_id}>"
-        trader_mention = f"<@{trader_id}>"
+    fields = []
+    for i, row in enumerate(rows, start=1):
+        middleman_id = row["middleman_user_id"]
         middleman_mention = f"<@{middleman_id}>" if middleman_id else "None"
-        stars = STAR * int(rating)
-        flag = f" {WARN}" if suspicious else ""
-
         value = (
-            f"**From:** {voucher_mention}\n"
-            f"**Trader:** {trader_mention}\n"
+            f"**From:** <@{row['voucher_user_id']}>\n"
+            f"**Trader:** <@{row['trader_user_id']}>\n"
             f"**Middleman:** {middleman_mention}\n"
-            f"**Rating:** {stars}{flag}\n"
-            f"**Item:** {traded_item}\n"
-            f"**Date:** {created_at}\n"
-            f"**ID:** `{vid}`"
+            f"**Rating:** {_STAR_TABLE[int(row['rating'])]}{f' {WARN}' if row['suspicious'] else ''}\n"
+            f"**Item:** {row['traded_item']}\n"
+            f"**Date:** {row['created_at']}\n"
+            f"**ID:** `{row['id']}`"
         )
-        embed.add_field(name=f"Vouch #{start_index + i}", value=value[:1024], inline=False)
+        fields.append({"name": f"Vouch #{start_index + i}", "value": value[:1024], "inline": False})
 
-    return embed
+    if not fields:
+        fields.append({"name": "No vouches", "value": "No results on this page.", "inline": False})
+
+    return discord.Embed.from_dict({
+        "title": f"Vouches for {user}",
+        "description": f"Total vouches: **{total}**",
+        "color": discord.Color.blurple().value,
+        "fields": fields,
+        "footer": {"text": f"Page {page + 1}/{total_pages} • Showing {PAGE_SIZE} per page"},
+    })
 
 
 class VouchesPaginator(discord.ui.View):
@@ -656,7 +1154,12 @@ class VouchesPaginator(discord.ui.View):
         self.guild_id = guild_id
         self.target_member = target_member
         self.page = 0
-        self.total = 0
+        self.total = 0  # counted once when the paginator opens
+        # Keyset cursors: cursor_stack[page] is the id to page past for that
+        # page (None = start at the newest vouch).
+        self.cursor_stack: list[int | None] = [None]
+        self.rows = []
+        self.has_next = False
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.requester_id:
@@ -667,20 +1170,28 @@ class VouchesPaginator(discord.ui.View):
             return False
         return True
 
+    async def load_page(self):
+        # Fetch one extra row: its presence means there is a next page,
+        # without running a COUNT on every flip.
+        rows = await fetch_vouches_after(
+            self.guild_id, self.target_member.id,
+            self.cursor_stack[self.page], PAGE_SIZE + 1
+        )
+        self.has_next = len(rows) > PAGE_SIZE
+        self.rows = rows[:PAGE_SIZE]
+
     def _set_button_state(self):
-        total_pages = max(1, (self.total + PAGE_SIZE - 1) // PAGE_SIZE)
         self.prev_btn.disabled = (self.page <= 0)
-        self.next_btn.disabled = (self.page >= total_pages - 1)
+        self.next_btn.disabled = not self.has_next
 
     async def refresh(self, interaction: discord.Interaction):
-        rows, total = await fetch_vouches_page(self.guild_id, self.target_member.id, self.page)
-        self.total = total
+        await self.load_page()
         self._set_button_state()
-        embed = build_vouches_embed(self.target_member, rows, self.total, self.page)
+        embed = build_vouches_embed(self.target_member, self.rows, self.total, self.page)
         await interaction.response.edit_message(
             embed=embed,
             view=self,
-            allowed_mentions=discord.AllowedMentions(users=True)
+            allowed_mentions=_AM_USERS
         )
 
     @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
@@ -691,8 +1202,9 @@ class VouchesPaginator(discord.ui.View):
 
     @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
     async def next_btn(self, interaction: discord.Interaction, button: discord.ui.Button):
-        total_pages = max(1, (self.total + PAGE_SIZE - 1) // PAGE_SIZE)
-        if self.page < total_pages - 1:
+        if self.has_next and self.rows:
+            if len(self.cursor_stack) == self.page + 1:
+                self.cursor_stack.append(self.rows[-1][0])
             self.page += 1
         await self.refresh(interaction)
 
@@ -743,7 +1255,7 @@ class TraderSelectStep(StepBaseView):
                 f"Step 2/3: Select a **Middleman** (optional) or press **Skip**."
             ),
             view=MiddlemanSelectStep(requester_id=self.requester_id, trader=trader),
-            allowed_mentions=discord.AllowedMentions(users=True)
+            allowed_mentions=_AM_USERS
         )
 
 
@@ -782,7 +1294,7 @@ class MiddlemanSelectStep(StepBaseView):
                 trader=self.trader,
                 middleman=middleman
             ),
-            allowed_mentions=discord.AllowedMentions(users=True)
+            allowed_mentions=_AM_USERS
         )
 
 
@@ -828,11 +1340,8 @@ class VouchModal(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction):
         # Validate rating
-        try:
-            stars = int(self.rating.value)
-            if not 1 <= stars <= 5:
-                raise ValueError
-        except ValueError:
+        stars = _RATING_MAP.get(self.rating.value.strip())
+        if stars is None:
             await interaction.response.send_message(
                 f"{CROSS} Rating must be a number between **1 and 5**.",
                 ephemeral=True
@@ -847,24 +1356,20 @@ class VouchModal(discord.ui.Modal):
             return
 
         # Requirement #8: Account age / join age checks
-        now_utc = datetime.now(timezone.utc)
-        if interaction.user.created_at:
-            acct_age_days = (now_utc - interaction.user.created_at).days
-            if acct_age_days < MIN_ACCOUNT_AGE_DAYS:
-                await interaction.response.send_message(
-                    f"{CROSS} Your account must be at least **{MIN_ACCOUNT_AGE_DAYS} days** old to submit vouches.",
-                    ephemeral=True
-                )
-                return
-
-        if interaction.user.joined_at:
-            join_hours = (now_utc - interaction.user.joined_at).total_seconds() / 3600.0
-            if join_hours < MIN_SERVER_JOIN_HOURS:
-                await interaction.response.send_message(
-                    f"{CROSS} You must be in this server for at least **{MIN_SERVER_JOIN_HOURS} hours** to submit vouches.",
-                    ephemeral=True
-                )
-                return
+        now_ts = time.time()
+        if interaction.user.created_at and now_ts - interaction.user.created_at.timestamp() < _MIN_ACCT_SECS:
+            await interaction.response.send_message(
+                f"{CROSS} Your account must be at least **{MIN_ACCOUNT_AGE_DAYS} days** old to submit vouches.",
+                ephemeral=True
+            )
+            return
+
+        if interaction.user.joined_at and now_ts - interaction.user.joined_at.timestamp() < _MIN_JOIN_SECS:
+            await interaction.response.send_message(
+                f"{CROSS} You must be in this server for at least **{MIN_SERVER_JOIN_HOURS} hours** to submit vouches.",
+                ephemeral=True
+            )
+            return
 
         vouched_user_id = self.vouched_user.id
 
@@ -876,7 +1381,7 @@ class VouchModal(discord.ui.Modal):
             title=f"{STAR} Trade Vouch",
             color=discord.Color.purple()
         )
-        embed.add_field(name="Rating", value=(STAR * stars) + (f" {WARN}" if suspicious else ""), inline=False)
+        embed.add_field(name="Rating", value=_STAR_TABLE[stars] + (f" {WARN}" if suspicious else ""), inline=False)
         embed.add_field(name="Who did you trade with", value=self.trader.mention, inline=False)
         embed.add_field(name="Middleman used", value=self.middleman.mention if self.middleman else "None", inline=False)
         embed.add_field(name="What did you trade to them", value=self.traded_item.value, inline=False)
@@ -889,56 +1394,70 @@ class VouchModal(discord.ui.Modal):
 
         # Save to DB
         created_at = utc_now_str()
-        async with _db_lock, db_open(DB_FILE) as db:
-            await db.execute("""
-                INSERT INTO vouches (
-                    guild_id, vouched_user_id, voucher_user_id,
-                    trader_user_id, middleman_user_id,
-                    rating, traded_item, created_at, suspicious
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                interaction.guild_id,
-                vouched_user_id,
-                interaction.user.id,
-                self.trader.id,
-                self.middleman.id if self.middleman else None,
-                stars,
-                self.traded_item.value,
-                created_at,
-                suspicious
-            ))
-            await db.commit()
-
-        # #11 DM receipt to vouched user
-        try:
-            dm = discord.Embed(
-                title=f"{STAR} You received a new vouch!",
-                description=f"Server: **{interaction.guild.name}**",
-                color=discord.Color.green()
-            )
-            dm.add_field(name="From", value=interaction.user.mention, inline=False)
-            dm.add_field(name="Rating", value=STAR * stars, inline=False)
-            dm.add_field(name="Trader", value=self.trader.mention, inline=False)
-            dm.add_field(name="Middleman", value=self.middleman.mention if self.middleman else "None", inline=False)
-            dm.add_field(name="Item", value=self.traded_item.value, inline=False)
-            if suspicious:
-                dm.add_field(name="Notice", value=f"{WARN} This vouch was auto-flagged as suspicious.", inline=False)
-            await self.vouched_user.send(embed=dm, allowed_mentions=discord.AllowedMentions(users=True))
-        except Exception:
-            pass
+        created_at_ts = int(datetime.now(timezone.utc).timestamp())
+        await write_vouch((
+            interaction.guild_id,
+            vouched_user_id,
+            interaction.user.id,
+            self.trader.id,
+            self.middleman.id if self.middleman else None,
+            stars,
+            self.traded_item.value,
+            created_at,
+            created_at_ts,
+            suspicious
+        ))
+
+        invalidate_trust_stats(interaction.guild_id, vouched_user_id)
+        invalidate_agg_cache(interaction.guild_id)
+        record_recent_vouch(interaction.guild_id, vouched_user_id, interaction.user.id, created_at_ts)
+
+        # #11 DM receipt to vouched user — fired off the response path; the
+        # done callback keeps the old silent-failure semantics (DMs closed).
+        dm = discord.Embed(
+            title=f"{STAR} You received a new vouch!",
+            description=f"Server: **{interaction.guild.name}**",
+            color=discord.Color.green()
+        )
+        dm.add_field(name="From", value=interaction.user.mention, inline=False)
+        dm.add_field(name="Rating", value=_STAR_TABLE[stars], inline=False)
+        dm.add_field(name="Trader", value=self.trader.mention, inline=False)
+        dm.add_field(name="Middleman", value=self.middleman.mention if self.middleman else "None", inline=False)
+        dm.add_field(name="Item", value=self.traded_item.value, inline=False)
+        if suspicious:
+            dm.add_field(name="Notice", value=f"{WARN} This vouch was auto-flagged as suspicious.", inline=False)
+        dm_task = asyncio.create_task(
+            self.vouched_user.send(embed=dm, allowed_mentions=_AM_USERS)
+        )
+        dm_task.add_done_callback(lambda t: t.exception())
 
-        # #15 Trust gate role assignment
-        await apply_trust_gate(interaction.guild, self.vouched_user)
+        # #15 Trust gate role assignment (debounced, off the response path)
+        schedule_trust_gate(interaction.guild, self.vouched_user)
 
         await interaction.response.send_message(
             embed=embed,
-            allowed_mentions=discord.AllowedMentions(users=True)
+            allowed_mentions=_AM_USERS
         )
 
 
 # ---------- ONLINE STATUS ----------
 _sent_online = False
 
+def _command_tree_hash() -> str:
+    """Stable digest of the registered slash commands.
+
+    tree.sync() is a full REST upload of every command, and on_ready fires on
+    every reconnect — only resync when the commands actually changed.
+    """
+    payload = []
+    for cmd in bot.tree.get_commands():
+        try:
+            payload.append(cmd.to_dict(bot.tree))
+        except TypeError:  # older discord.py: to_dict() takes no tree
+            payload.append(cmd.to_dict())
+    raw = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(raw).hexdigest()
+
 @bot.event
 async def on_ready():
     global _sent_online
@@ -954,9 +1473,16 @@ async def on_ready():
     try:
         await init_db()
         await init_config_table()
+        await warm_recent_vouches()
     except Exception as e:
         print(f"DB init error: {e}")
 
+    if not prune_recent_vouches.is_running():
+        prune_recent_vouches.start()
+
+    if not flush_softlock_changes.is_running():
+        flush_softlock_changes.start()
+
     if not _sent_online:
         _sent_online = True
         # Send an online notice to each server's configured status channel (if set).
@@ -972,7 +1498,15 @@ async def on_ready():
                 pass
 
     try:
-        await bot.tree.sync()
+        tree_hash = _command_tree_hash()
+        stored = ""
+        if os.path.exists(COMMAND_HASH_FILE):
+            with open(COMMAND_HASH_FILE) as f:
+                stored = f.read().strip()
+        if tree_hash != stored:
+            await bot.tree.sync()
+            with open(COMMAND_HASH_FILE, "w") as f:
+                f.write(tree_hash)
     except Exception as e:
         print(f"Slash sync error: {e}")
 
@@ -1038,22 +1572,23 @@ async def vouches(interaction: discord.Interaction, user: discord.Member):
         guild_id=interaction.guild_id,
         target_member=user
     )
-    rows, total = await fetch_vouches_page(interaction.guild_id, user.id, 0)
-    view.total = total
-    view._set_button_state()
+    view.total = await fetch_vouch_total(interaction.guild_id, user.id)
 
-    if total == 0:
+    if view.total == 0:
         return await interaction.response.send_message(
             f"No vouches found for {user.mention}.",
             ephemeral=True
         )
 
-    embed = build_vouches_embed(user, rows, total, 0)
+    await view.load_page()
+    view._set_button_state()
+
+    embed = build_vouches_embed(user, view.rows, view.total, 0)
     await interaction.response.send_message(
         embed=embed,
         view=view,
         ephemeral=True,
-        allowed_mentions=discord.AllowedMentions(users=True)
+        allowed_mentions=_AM_USERS
     )
 
 
@@ -1108,7 +1643,19 @@ async def softlock(interaction: discord.Interaction):
     everyone = interaction.guild.default_role
 
     prev = channel.overwrites_for(everyone)
-    _softlock_previous[channel.id] = prev
+    _softlock_previous[channel.id] = SavedOverwrite(
+        send_messages=prev.send_messages,
+        add_reactions=prev.add_reactions,
+        create_public_threads=prev.create_public_threads,
+        create_private_threads=prev.create_private_threads,
+    )
+    _softlock_previous.move_to_end(channel.id)
+    while len(_softlock_previous) > _SOFTLOCK_PREVIOUS_MAX:
+        _softlock_previous.popitem(last=False)
+
+    me = interaction.guild.me
+    if me is None or not channel.permissions_for(me).manage_roles:
+        return await interaction.response.send_message(f"{CROSS} I need permission to manage channel overwrites.", ephemeral=True)
 
     new_overwrite = prev
     new_overwrite.send_messages = False
@@ -1116,10 +1663,7 @@ async def softlock(interaction: discord.Interaction):
     new_overwrite.create_public_threads = False
     new_overwrite.create_private_threads = False
 
-    try:
-        await channel.set_permissions(everyone, overwrite=new_overwrite, reason="Softlock")
-    except discord.Forbidden:
-        return await interaction.response.send_message(f"{CROSS} I need permission to manage channel overwrites.", ephemeral=True)
+    queue_overwrite_flush(channel, new_overwrite, "Softlock")
 
     await interaction.response.send_message(f"{LOCK} Soft-locked {channel.mention}.", ephemeral=False)
 
@@ -1135,16 +1679,27 @@ async def softunlock(interaction: discord.Interaction):
     channel: discord.TextChannel = interaction.channel
     everyone = interaction.guild.default_role
 
-    prev = _softlock_previous.get(channel.id)
-    if prev is None:
+    saved = _softlock_previous.get(channel.id)
+    if saved is None:
         return await interaction.response.send_message(f"{CROSS} No saved softlock state for this channel.", ephemeral=True)
 
-    try:
-        await channel.set_permissions(everyone, overwrite=prev, reason="Softunlock")
-    except discord.Forbidden:
+    me = interaction.guild.me
+    if me is None or not channel.permissions_for(me).manage_roles:
         return await interaction.response.send_message(f"{CROSS} I need permission to manage channel overwrites.", ephemeral=True)
 
-    _softlock_previous.pop(channel.id, None)
+    overwrite = channel.overwrites_for(everyone)
+    overwrite.send_messages = saved.send_messages
+    overwrite.add_reactions = saved.add_reactions
+    overwrite.create_public_threads = saved.create_public_threads
+    overwrite.create_private_threads = saved.create_private_threads
+
+    # Drop the snapshot only once the overwrite actually lands; a failed
+    # flush leaves it in place so /softunlock can be retried.
+    queue_overwrite_flush(
+        channel, overwrite, "Softunlock",
+        on_success=lambda cid=channel.id: _softlock_previous.pop(cid, None)
+    )
+
     await interaction.response.send_message(f"{CHECK} Soft-unlocked {channel.mention}.", ephemeral=False)
 
 
@@ -1154,23 +1709,22 @@ async def stats(interaction: discord.Interaction):
     if interaction.guild is None:
         return await interaction.response.send_message(f"{CROSS} Server only.", ephemeral=True)
 
-    async with _db_lock, db_open(DB_FILE) as db:
-        cur = await db.execute("""
-            SELECT COUNT(*), AVG(rating), SUM(suspicious)
-            FROM vouches
-            WHERE guild_id = ?
-        """, (interaction.guild_id,))
-        total, avg, suspicious_sum = await cur.fetchone()
+    cached = agg_cache_get("stats", interaction.guild_id)
+    if cached is not None:
+        return await interaction.response.send_message(embed=cached, ephemeral=True)
 
-        cur2 = await db.execute("""
-            SELECT middleman_user_id, COUNT(*), AVG(rating)
-            FROM vouches
-            WHERE guild_id = ? AND middleman_user_id IS NOT NULL
-            GROUP BY middleman_user_id
-            ORDER BY COUNT(*) DESC
-            LIMIT 5
-        """, (interaction.guild_id,))
-        top_middlemen = await cur2.fetchall()
+    async with POOL.connection() as db:
+        cur = await db.execute(_SQL_GUILD_OVERVIEW, (interaction.guild_id, interaction.guild_id))
+        rows = await cur.fetchall()
+
+    total, avg, suspicious_sum = 0, None, 0
+    top_middlemen = []
+    for row in rows:
+        if row["kind"] == "agg":
+            total, avg, suspicious_sum = row["count"], row["avg_rating"], row["suspicious"]
+        else:
+            top_middlemen.append((row["user_id"], row["count"], row["avg_rating"]))
+    top_middlemen.sort(key=lambda r: r[1], reverse=True)
 
     embed = discord.Embed(title="Server Vouch Stats", color=discord.Color.teal())
     embed.add_field(name="Total vouches", value=str(total or 0), inline=True)
@@ -1185,6 +1739,7 @@ async def stats(interaction: discord.Interaction):
     else:
         embed.add_field(name="Top Middlemen", value="No middleman data yet.", inline=False)
 
+    agg_cache_put("stats", interaction.guild_id, embed)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
@@ -1194,15 +1749,14 @@ async def leaderboard(interaction: discord.Interaction):
     if interaction.guild is None:
         return await interaction.response.send_message(f"{CROSS} Server only.", ephemeral=True)
 
-    async with _db_lock, db_open(DB_FILE) as db:
-        cur = await db.execute("""
-            SELECT vouched_user_id, COUNT(*) AS c, AVG(rating) AS a
-            FROM vouches
-            WHERE guild_id = ?
-            GROUP BY vouched_user_id
-            ORDER BY c DESC, a DESC
-            LIMIT 10
-        """, (interaction.guild_id,))
+    cached = agg_cache_get("leaderboard", interaction.guild_id)
+    if cached is not None:
+        return await interaction.response.send_message(
+            embed=cached, ephemeral=True, allowed_mentions=_AM_USERS
+        )
+
+    async with POOL.connection() as db:
+        cur = await db.execute(_SQL_LEADERBOARD, (interaction.guild_id,))
         rows = await cur.fetchall()
 
     if not rows:
@@ -1214,7 +1768,8 @@ async def leaderboard(interaction: discord.Interaction):
         lines.append(f"**#{idx}** <@{uid}> — **{count}** vouches • avg **{(avg or 0):.2f}/5**")
     embed.description = "\n".join(lines)
 
-    await interaction.response.send_message(embed=embed, ephemeral=True, allowed_mentions=discord.AllowedMentions(users=True))
+    agg_cache_put("leaderboard", interaction.guild_id, embed)
+    await interaction.response.send_message(embed=embed, ephemeral=True, allowed_mentions=_AM_USERS)
 
 
 # #12 EXPORT VOUCHES (CSV)
@@ -1226,28 +1781,34 @@ async def exportvouches(interaction: discord.Interaction, user: discord.Member):
     if not interaction.user.guild_permissions.administrator:
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
-    async with _db_lock, db_open(DB_FILE) as db:
-        cur = await db.execute("""
-            SELECT id, voucher_user_id, trader_user_id, middleman_user_id, rating, traded_item, created_at, suspicious
-            FROM vouches
-            WHERE guild_id = ? AND vouched_user_id = ?
-            ORDER BY id DESC
-        """, (interaction.guild_id, user.id))
-        rows = await cur.fetchall()
-
-    if not rows:
+    # Stream rows from the cursor straight into a csv.writer: correct quoting
+    # (the old manual escaping missed commas/newlines) and bounded memory
+    # regardless of export size.
+    buf = BytesIO()
+    text = TextIOWrapper(buf, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow([
+        "id", "vouched_user_id", "voucher_user_id", "trader_user_id",
+        "middleman_user_id", "rating", "traded_item", "created_at", "suspicious",
+    ])
+
+    row_count = 0
+    async with POOL.connection() as db:
+        cur = await db.execute(_SQL_EXPORT, (interaction.guild_id, user.id))
+        async for r in cur:
+            writer.writerow([
+                r["id"], user.id, r["voucher_user_id"], r["trader_user_id"],
+                r["middleman_user_id"], r["rating"], r["traded_item"],
+                r["created_at"], r["suspicious"],
+            ])
+            row_count += 1
+
+    if row_count == 0:
         return await interaction.response.send_message(f"No vouches found for {user.mention}.", ephemeral=True)
 
-    csv_lines = ["id,vouched_user_id,voucher_user_id,trader_user_id,middleman_user_id,rating,traded_item,created_at,suspicious"]
-    for r in rows:
-        vid, voucher_id, trader_id, mm_id, rating, item, created_at, suspicious = r
-        item_safe = str(item).replace('"', '""')
-        csv_lines.append(
-            f'{vid},{user.id},{voucher_id},{trader_id},{mm_id or ""},{rating},"{item_safe}","{created_at}",{suspicious}'
-        )
-
-    data = "\n".join(csv_lines).encode("utf-8")
-    file = discord.File(fp=BytesIO(data), filename=f"vouches_{user.id}.csv")  # type: ignore
+    text.flush()
+    buf.seek(0)
+    file = discord.File(fp=buf, filename=f"vouches_{user.id}.csv")  # type: ignore
 
     await interaction.response.send_message(
         content=f"{CHECK} Export for {user.mention}:",
@@ -1267,8 +1828,8 @@ async def maxmute(interaction: discord.Interaction, user: discord.Member, reason
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
     # staff immunity (#5)
-    protected_ids = await cfg_get(interaction.guild_id, "PROTECTED_ROLE_IDS") or []
-    if any(role.id in protected_ids for role in user.roles):
+    protected_ids = frozenset(await cfg_get(interaction.guild_id, "PROTECTED_ROLE_IDS") or [])
+    if not protected_ids.isdisjoint(r.id for r in user.roles):
         return await interaction.response.send_message(
             f"{CROSS} That user is protected (staff immunity).",
             ephemeral=True
@@ -1311,7 +1872,7 @@ async def maxmute(interaction: discord.Interaction, user: discord.Member, reason
     )
     embed.add_field(name="Reason", value=reason, inline=False)
     embed.set_footer(text=f"Action by {interaction.user}")
-    await interaction.response.send_message(embed=embed, allowed_mentions=discord.AllowedMentions(users=True))
+    await interaction.response.send_message(embed=embed, allowed_mentions=_AM_USERS)
 
 
 @bot.tree.command(name="unmute", description="Remove a timeout from a user (Admin only).")
@@ -1353,7 +1914,7 @@ async def unmute(interaction: discord.Interaction, user: discord.Member, reason:
     )
     embed.add_field(name="Reason", value=reason, inline=False)
     embed.set_footer(text=f"Action by {interaction.user}")
-    await interaction.response.send_message(embed=embed, allowed_mentions=discord.AllowedMentions(users=True))
+    await interaction.response.send_message(embed=embed, allowed_mentions=_AM_USERS)
 
 
 # ---------- SETUP / CONFIG ----------
@@ -1415,10 +1976,11 @@ async def reset_defaults(interaction: discord.Interaction):
     if not _admin_only(interaction):
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
-    async with _db_lock, db_open(DB_FILE) as db:
+    async with db_write() as db:
         await db.execute("DELETE FROM guild_config WHERE guild_id = ?", (interaction.guild_id,))
         await db.commit()
 
+    invalidate_gate_cache(interaction.guild_id)
     await interaction.response.send_message(f"{CHECK} Reset complete. Run `/setup` to confirm.", ephemeral=True)
 
 @config_group.command(name="set_owner", description="Set the owner ID used for /shutdown authorization.")
@@ -1450,6 +2012,7 @@ async def set_trusted_role(interaction: discord.Interaction, role: discord.Role)
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
     await cfg_set(interaction.guild_id, "TRUSTED_ROLE_ID", role.id)
+    invalidate_gate_cache(interaction.guild_id)
     await interaction.response.send_message(f"{CHECK} Trusted role set to {role.mention}.", ephemeral=True)
 
 @config_group.command(name="disable_trusted_role", description="Disable Trusted auto-role assignment.")
@@ -1458,6 +2021,7 @@ async def disable_trusted_role(interaction: discord.Interaction):
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
     await cfg_set(interaction.guild_id, "TRUSTED_ROLE_ID", 0)
+    invalidate_gate_cache(interaction.guild_id)
     await interaction.response.send_message(f"{CHECK} Trusted role disabled.", ephemeral=True)
 
 @config_group.command(name="set_restricted_role", description="Set the Restricted role.")
@@ -1467,6 +2031,7 @@ async def set_restricted_role(interaction: discord.Interaction, role: discord.Ro
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
     await cfg_set(interaction.guild_id, "RESTRICTED_ROLE_ID", role.id)
+    invalidate_gate_cache(interaction.guild_id)
     await interaction.response.send_message(f"{CHECK} Restricted role set to {role.mention}.", ephemeral=True)
 
 @config_group.command(name="disable_restricted_role", description="Disable Restricted auto-role assignment.")
@@ -1475,6 +2040,7 @@ async def disable_restricted_role(interaction: discord.Interaction):
         return await interaction.response.send_message(f"{CROSS} Admin only.", ephemeral=True)
 
     await cfg_set(interaction.guild_id, "RESTRICTED_ROLE_ID", 0)
+    invalidate_gate_cache(interaction.guild_id)
     await interaction.response.send_message(f"{CHECK} Restricted role disabled.", ephemeral=True)
 
 @config_group.command(name="add_protected_role", description="Add a role to staff immunity (protected).")
@@ -1554,6 +2120,11 @@ def _install_signal_handlers():
                     await channel.send("**AMP VOUCHER BOT CURRENTLY OFFLINE (Host restart/stop)**")
             except Exception:
                 pass
+        try:
+            await POOL.close()
+        except Exception:
+            pass
+        close_writer()
         try:
             await bot.close()
         except Exception:
@@ -1580,8 +2151,7 @@ async def shutdown(interaction: discord.Interaction, code: str):
         await interaction.response.send_message(f"{CROSS} You are not authorized.", ephemeral=True)
         return
 
-    totp = pyotp.TOTP(TOTP_SECRET)
-    if not totp.verify(code):
+    if _TOTP is None or not _TOTP.verify(code):
         await interaction.response.send_message(f"{CROSS} Invalid Google Authenticator code.", ephemeral=True)
         return
 
@@ -1592,6 +2162,8 @@ async def shutdown(interaction: discord.Interaction, code: str):
         await channel.send("**AMP VOUCHER BOT CURRENTLY OFFLINE AND UNDER MAINTENANCE**")
 
     print("Shutting down bot...")
+    await POOL.close()
+    close_writer()
     await bot.close()
     sys.exit(0)
 